@@ -0,0 +1,232 @@
+# app/cache.py
+# Caches usados pelas rotas do main.py: LRU em memória (por processo) e,
+# opcionalmente, uma segunda camada no Redis.
+
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Hashable, Optional
+
+log = logging.getLogger("licitabot")
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Dicionário com tamanho máximo: passando de `maxsize`, descarta o item
+    usado há mais tempo. Com `ttl` (segundos), itens mais velhos que isso
+    são tratados como ausentes.
+    Protegido por lock, pode ser usado a partir do threadpool.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # chave -> (valor, instante da gravação)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, stored = item
+            if self.ttl is not None and time.monotonic() - stored > self.ttl:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# Redis é opcional: só entra em uso com REDIS_URL configurada e o
+# pacote `redis` instalado.
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except Exception:
+    REDIS_AVAILABLE = False
+
+
+class TwoTierCache:
+    """
+    L1 = LRUCache local (por processo); L2 = Redis compartilhado entre
+    workers e deploys. Valores precisam ser serializáveis em JSON.
+    Se o Redis falhar, segue só com o L1.
+    `hits`/`misses` contam as consultas deste processo (ver stats()).
+
+    Invalidação por geração: quem usa o cache põe generation() na chave
+    e bump() passa para a próxima. Com Redis o contador fica lá (INCR),
+    compartilhado entre os workers; as chaves velhas expiram pelo
+    redis_ttl. Cada worker relê a geração a cada `gen_ttl` segundos.
+    """
+
+    def __init__(self, prefix: str, maxsize: int = 1024, ttl: float = 600,
+                 redis_url: Optional[str] = None, redis_ttl: int = 900,
+                 gen_ttl: float = 1.0):
+        self.prefix = prefix
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.redis_ttl = redis_ttl
+        self.gen_ttl = gen_ttl
+        self.hits = 0
+        self.misses = 0
+        self._gen = 0
+        self._gen_ts = 0.0  # quando _gen foi lido do Redis
+        self._redis = None
+        if redis_url and REDIS_AVAILABLE:
+            self._redis = aioredis.from_url(
+                redis_url, socket_timeout=0.2, socket_connect_timeout=0.2
+            )
+
+    async def get(self, key: str) -> Any:
+        value = self.local.get(key)
+        if value is None and self._redis is not None:
+            value = await self._get_remote(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def _get_remote(self, key: str) -> Any:
+        try:
+            raw = await self._redis.get(self.prefix + key)
+        except Exception as e:
+            log.warning(f"[CACHE] Redis indisponível (get): {e}")
+            return None
+        if raw is None:
+            return None
+        value = json.loads(raw)
+        self.local.set(key, value)
+        return value
+
+    async def set(self, key: str, value: Any):
+        self.local.set(key, value)
+        if self._redis is None:
+            return
+        try:
+            await self._redis.set(
+                self.prefix + key, json.dumps(value), ex=self.redis_ttl
+            )
+        except Exception as e:
+            log.warning(f"[CACHE] Redis indisponível (set): {e}")
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "local_size": len(self.local),
+            "generation": self._gen,
+            "redis": self._redis is not None,
+        }
+
+    async def generation(self) -> int:
+        if self._redis is None:
+            return self._gen
+        now = time.monotonic()
+        if now - self._gen_ts < self.gen_ttl:
+            return self._gen
+        try:
+            self._gen = int(await self._redis.get(self.prefix + "gen") or 0)
+            self._gen_ts = now
+        except Exception as e:
+            log.warning(f"[CACHE] Redis indisponível (generation): {e}")
+        return self._gen
+
+    async def bump(self):
+        self.local.clear()
+        if self._redis is not None:
+            try:
+                self._gen = int(await self._redis.incr(self.prefix + "gen"))
+                self._gen_ts = time.monotonic()
+                return
+            except Exception as e:
+                log.warning(f"[CACHE] Redis indisponível (bump): {e}")
+        self._gen += 1
+
+
+# numpy já vem com o chromadb; sem ele o cache semântico fica desligado
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except Exception:
+    NUMPY_AVAILABLE = False
+
+
+class SemanticCache:
+    """
+    Cache por similaridade: guarda os `maxlen` últimos pares (embedding da
+    pergunta, valor) e devolve o valor quando uma pergunta nova tem
+    cosseno >= `threshold` com alguma guardada (ex.: mesma pergunta com
+    outras palavras). Por processo, protegido por lock.
+    Como no TwoTierCache, cada item leva a versão de quem gravou e só
+    vale para consultas da mesma versão, por até `ttl` segundos.
+    """
+
+    def __init__(self, maxlen: int = 256, threshold: float = 0.97,
+                 ttl: Optional[float] = None):
+        self.threshold = threshold
+        self.ttl = ttl
+        # (vetor unitário, valor, versão, instante da gravação)
+        self._items = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vec):
+        v = np.asarray(vec, dtype=np.float32)
+        n = float(np.linalg.norm(v))
+        return v / n if n else None
+
+    def get(self, vec, version: Hashable = None) -> Any:
+        if not NUMPY_AVAILABLE or vec is None:
+            return None
+        v = self._unit(vec)
+        if v is None:
+            return None
+        oldest = time.monotonic() - self.ttl if self.ttl is not None else None
+        with self._lock:
+            items = [
+                (e, val) for e, val, ver, ts in self._items
+                if ver == version and (oldest is None or ts >= oldest)
+            ]
+        if not items:
+            return None
+        mat = np.stack([e for e, _ in items])
+        values = [val for _, val in items]
+        if mat.shape[1] != v.shape[0]:
+            return None
+        sims = mat @ v
+        best = int(np.argmax(sims))
+        return values[best] if sims[best] >= self.threshold else None
+
+    def add(self, vec, value: Any, version: Hashable = None):
+        if not NUMPY_AVAILABLE or vec is None:
+            return
+        v = self._unit(vec)
+        if v is None:
+            return
+        with self._lock:
+            self._items.append((v, value, version, time.monotonic()))
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -24,7 +24,10 @@ def answer(question: str, context: str) -> str:
         {"role": "system", "content": SYSTEM_PROMPT},
         # Instrução reforço: contexto é a ÚNICA fonte
         {"role": "system", "content": "IMPORTANTE: ignore qualquer conhecimento externo; use somente o CONTEXTO."},
-        {"role": "user", "content": f"Pergunta: {question}\n\nCONTEXTO (use apenas este material):\n{context}"}
+        # contexto antes da pergunta: o prefixo (system + contexto) se repete
+        # entre perguntas sobre os mesmos trechos e entra no cache de
+        # prompt da OpenAI
+        {"role": "user", "content": f"CONTEXTO (use apenas este material):\n{context}\n\nPergunta: {question}"}
     ]
     res = client.chat.completions.create(
         model="gpt-4o",
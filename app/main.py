@@ -1,10 +1,25 @@
 # -*- coding: utf-8 -*-
 import os
+import re
 import time
+import asyncio
+import math
 import hmac
+import base64
+import threading
 import hashlib
+import gzip
+import json
 import logging
-from typing import Optional, List
+import unicodedata
+import uuid
+import errno
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from email.utils import formatdate
+from typing import Optional, List, Tuple
 
 from fastapi import (
     FastAPI, Request, UploadFile, File, Header,
@@ -16,53 +31,109 @@ from fastapi.responses import (
 )
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.concurrency import run_in_threadpool
 
-# RAG (sua base vetorial)
-from .rag_store import ingest_paths, search, context_from_hits, load_pdf_text
-from .core import answer
+# orjson serializa JSON bem mais rápido que o json da stdlib; se não
+# estiver instalado, as respostas continuam com o JSONResponse padrão
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except Exception:
+    ORJSON_AVAILABLE = False
+
+from .cache import LRUCache, TwoTierCache, SemanticCache
 
 # -----------------------------------------------------------------------------
 log = logging.getLogger("licitabot")
 log.setLevel(logging.INFO)
 
-app = FastAPI(title="Licitabot — Cloud")
+# RAG (sua base vetorial) e LLM: rag_store puxa chromadb/pypdf/tiktoken e
+# core puxa openai, que demoram a importar. Só carregam no primeiro uso,
+# assim o boot e o /health respondem logo.
+_rag_mod = None
+_core_mod = None
+
+def _rag():
+    global _rag_mod
+    if _rag_mod is None:
+        from . import rag_store as _rag_mod
+    return _rag_mod
+
+def _core():
+    global _core_mod
+    if _core_mod is None:
+        from . import core as _core_mod
+    return _core_mod
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _ingest_queue, _ingest_pool
+    _ingest_queue = asyncio.Queue()
+    _ingest_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+    worker = asyncio.create_task(_ingest_worker())
+    # aquece o RAG em segundo plano: o servidor já responde (/health) e a
+    # primeira pergunta não paga a carga do Chroma/modelo de embedding
+    warm = asyncio.create_task(asyncio.to_thread(_warmup))
+    yield
+    warm.cancel()
+    worker.cancel()
+    _ingest_pool.shutdown(wait=False, cancel_futures=True)
+
+def _warmup():
+    try:
+        t0 = time.monotonic()
+        _rag().warmup()
+        _core()
+        log.info(f"[WARMUP] RAG pronto em {time.monotonic() - t0:.1f}s")
+    except Exception:
+        log.exception("Falha no aquecimento do RAG")
 
-# CORS para permitir que o painel admin/Swagger use multipart e leia JSON
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],          # pode fechar depois se quiser
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+class ORJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+DefaultJSONResponse = ORJSONResponse if ORJSON_AVAILABLE else JSONResponse
+
+app = FastAPI(
+    title="Licitabot — Cloud",
+    lifespan=lifespan,
+    default_response_class=DefaultJSONResponse,
 )
 
+# CORS: o painel admin, a página de login e o Swagger são servidos por
+# este mesmo app (mesma origem) e não precisam dele. Só liga se
+# CORS_ORIGINS listar origens externas (separadas por vírgula).
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()]
+if CORS_ORIGINS:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "DELETE"],
+        allow_headers=["Content-Type", "X-Admin-Token"],
+        max_age=600,
+    )
+
+# compacta HTML/JSON/CSS acima de 512 bytes (as páginas têm bastante CSS
+# inline; respostas do /ask com citações são texto corrido)
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=5)
+
 # -----------------------------------------------------------------------------
 # Localização de diretórios (templates, static, uploads e índice)
-def _first_existing(candidates):
-    for p in candidates:
-        if os.path.isdir(p):
-            return p
-    # fallback pro primeiro, mesmo que não exista (pra debug)
-    return candidates[0]
-
-TEMPLATES_DIR = _first_existing([
-    "templates",
-    "app/templates",
-    "/app/templates",
-])
-
-STATIC_DIR = _first_existing([
-    "static",
-    "app/static",
-    "/app/static",
-])
+# templates/ e static/ ficam ao lado deste arquivo: caminho absoluto, sem
+# depender do diretório de onde o uvicorn foi chamado
+APP_DIR       = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(APP_DIR, "templates")
+STATIC_DIR    = os.path.join(APP_DIR, "static")
 
 # pasta persistente dos PDFs:
 # se você tem um Disk montado em /data no Render, usamos /data/uploaded_pdfs
 # se não, cai no fallback dentro do container/app
 DEFAULT_UPLOAD_BASE = "/data"
-FALLBACK_UPLOAD_BASE = os.path.dirname(__file__)  # app/
+FALLBACK_UPLOAD_BASE = APP_DIR  # app/
 if os.path.isdir(DEFAULT_UPLOAD_BASE):
     BASE_DIR = DEFAULT_UPLOAD_BASE
 else:
@@ -73,9 +144,147 @@ CHROMA_DIR = os.path.join(BASE_DIR, "chroma")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(CHROMA_DIR, exist_ok=True)
 
+# hash (BLAKE2b) do conteúdo de cada PDF já indexado: reenviar o mesmo
+# arquivo não dispara nova indexação. Fica junto do índice, fora da pasta
+# dos PDFs (não aparece na listagem nem pode ser excluído por /delete_pdf).
+HASHES_FILE = os.path.join(CHROMA_DIR, "pdf_hashes.json")
+_OLD_HASHES_FILE = os.path.join(UPLOAD_DIR, ".hashes.json")
+
+def _load_hashes() -> dict:
+    try:
+        if os.path.exists(_OLD_HASHES_FILE) and not os.path.exists(HASHES_FILE):
+            os.replace(_OLD_HASHES_FILE, HASHES_FILE)  # local antigo
+        with open(HASHES_FILE, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+def _save_hashes(hashes: dict):
+    """
+    Grava uma cópia de _pdf_hashes tirada no event loop. Roda na thread de
+    indexação (_ingest_pool): disco fora do loop e uma gravação por vez.
+    """
+    tmp = HASHES_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(hashes, fh)
+    os.replace(tmp, HASHES_FILE)
+
+_pdf_hashes = _load_hashes()  # nome do arquivo -> hash hex
+
+# hash do conteúdo mais recente ACEITO para cada nome (em disco, ainda na
+# fila ou já indexado). É com ele que o upload decide "sem alterações":
+# reenviar a versão anterior enquanto a nova espera na fila tem de valer.
+_accepted_hashes = dict(_pdf_hashes)
+
+def _is_pdf(name: str) -> bool:
+    # só os 4 últimos caracteres em minúsculas (não copia o nome inteiro)
+    return name[-4:].lower() == ".pdf"
+
+# Cópias de upload (.part) que ficaram para trás quando o processo caiu
+# no meio da gravação. Só as com mais de uma hora: as recentes podem ser
+# de um envio em andamento em outro worker.
+PART_MAX_AGE = 3600  # segundos
+
+def _remove_stale_parts():
+    limite = time.time() - PART_MAX_AGE
+    with os.scandir(UPLOAD_DIR) as it:
+        for e in it:
+            if e.name.endswith(".part") and e.stat().st_mtime < limite:
+                try:
+                    os.remove(e.path)
+                except OSError:
+                    pass
+
+_remove_stale_parts()
+
+# Lista (ordenada) dos PDFs em UPLOAD_DIR, montada com os.scandir só
+# quando necessário; upload_pdf e delete_pdf a invalidam. Também vale só
+# enquanto o mtime da pasta não muda (um stat por chamada), assim
+# alterações feitas por outro worker são percebidas.
+_pdf_index: Optional[Tuple[int, List[str]]] = None  # (mtime_ns, nomes)
+
+def _list_pdf_names() -> List[str]:
+    global _pdf_index
+    mtime = os.stat(UPLOAD_DIR).st_mtime_ns
+    if _pdf_index is None or _pdf_index[0] != mtime:
+        with os.scandir(UPLOAD_DIR) as it:
+            names = sorted(
+                e.name for e in it
+                if _is_pdf(e.name) and e.is_file()
+            )
+        _pdf_index = (mtime, names)
+    return _pdf_index[1]
+
+def _invalidate_pdf_index():
+    global _pdf_index
+    _pdf_index = None
+
 # monta /static para servir CSS etc
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+# Arquivos com hash no nome (ex.: app.3f9a1c2e.css) nunca mudam: cache de
+# 1 ano, imutável. Os demais (style.css) ficam 1 hora em cache e depois
+# revalidam pelo ETag/Last-Modified que o StaticFiles já envia.
+_HASHED_ASSET = re.compile(r"\.[0-9a-f]{8,}\.[A-Za-z0-9]+$")
+
+class CachedStaticFiles(StaticFiles):
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        resp = super().file_response(full_path, stat_result, scope, status_code)
+        if _HASHED_ASSET.search(str(full_path)):
+            resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            resp.headers["Cache-Control"] = "public, max-age=3600"
+        return resp
+
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
+# os templates não mudam com o processo rodando: compila uma vez e não
+# refaz stat() no arquivo a cada renderização
+templates.env.auto_reload = False
+# bytecode compilado fica em disco: os outros workers (WEB_CONCURRENCY) e
+# os próximos boots reaproveitam em vez de recompilar os templates.
+# Sem diretório explícito o Jinja usa o dele, por usuário, e confere
+# dono/permissão 0700 (um caminho fixo no /tmp poderia ser plantado).
+try:
+    templates.env.bytecode_cache = FileSystemBytecodeCache()
+except (OSError, RuntimeError):
+    pass  # sem /tmp gravável: compila em memória como antes
+
+# login.html e admin.html não dependem da requisição: renderiza uma vez
+# no boot e serve sempre os mesmos bytes, com ETag para o navegador
+# revalidar sem baixar de novo. A versão gzip também sai pronta do boot
+# (o GZipMiddleware não recomprime resposta que já tem Content-Encoding).
+def _render_page(name: str) -> Tuple[bytes, bytes, str]:
+    html = templates.get_template(name).render().encode()
+    gz = gzip.compress(html, compresslevel=9, mtime=0)
+    etag = hashlib.blake2b(html, digest_size=8).hexdigest()
+    return html, gz, etag
+
+def _page_response(request: Request, page: Tuple[bytes, bytes, str]) -> Response:
+    html, gz, etag = page
+    use_gz = "gzip" in request.headers.get("accept-encoding", "")
+    etag = f'"{etag}-gz"' if use_gz else f'"{etag}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if use_gz:
+        headers["Content-Encoding"] = "gzip"
+        return HTMLResponse(gz, headers=headers)
+    return HTMLResponse(html, headers=headers)
+
+def _etag_json(request: Request, etag: str, build, headers=None) -> Response:
+    """
+    Responde JSON com `etag` já calculado pelo chamador; se o cliente já
+    tem essa versão (If-None-Match), devolve 304 sem montar nem
+    serializar o corpo (`build()` só roda quando precisa).
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache", **(headers or {})}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    resp = DefaultJSONResponse(build())
+    resp.headers.update(headers)
+    return resp
+
+_LOGIN_PAGE = _render_page("login.html")
+_ADMIN_PAGE = _render_page("admin.html")
 
 # -----------------------------------------------------------------------------
 # Variáveis de ambiente que controlam acesso
@@ -87,53 +296,316 @@ ADMIN_UPLOAD_TOKEN = (
 ).strip()
 SECRET_KEY = (os.getenv("SECRET_KEY", "troque-este-segredo") or "troque-este-segredo").strip()
 
+# versões em bytes, prontas para comparação em tempo constante
+_ACCESS_PASSWORD_B = ACCESS_PASSWORD.encode()
+_ADMIN_TOKEN_B     = ADMIN_UPLOAD_TOKEN.encode()
+
+def _is_admin(token: Optional[str]) -> bool:
+    """Confere o token admin com hmac.compare_digest (sem vazar tempo)."""
+    if not token:
+        return False
+    return hmac.compare_digest(token.strip().encode(), _ADMIN_TOKEN_B)
+
+def _require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dependência das rotas de admin: exige o header x-admin-token."""
+    if not _is_admin(x_admin_token):
+        raise HTTPException(status_code=401, detail="Token de administrador inválido.")
+
 # -----------------------------------------------------------------------------
 # Sessão simples com cookie
 SESSION_COOKIE = "licita_sess"
 SESSION_TTL    = 60 * 60 * 24 * 7  # 7 dias
 
+# Assinatura com BLAKE2b em modo chaveado (MAC nativo, sem a dupla
+# passada do HMAC). A chave do BLAKE2b aceita no máximo 64 bytes, então
+# segredos maiores são reduzidos com o próprio BLAKE2b.
+_SECRET_KEY_B = SECRET_KEY.encode()
+if len(_SECRET_KEY_B) > hashlib.blake2b.MAX_KEY_SIZE:
+    _SECRET_KEY_B = hashlib.blake2b(_SECRET_KEY_B).digest()
+
+# O BLAKE2b chaveado processa a chave como um bloco inteiro na criação;
+# esse estado fica pronto aqui e cada assinatura só faz .copy()
+_SIGNER = hashlib.blake2b(key=_SECRET_KEY_B, digest_size=16)
+
+def _sign(payload: str) -> bytes:
+    h = _SIGNER.copy()
+    h.update(payload.encode())
+    return h.digest()
+
 def _make_token(username: str = "cliente") -> str:
+    # exp com largura fixa (10 dígitos) e assinatura em base64 url-safe
     exp = int(time.time()) + SESSION_TTL
-    payload = f"{username}:{exp}"
-    sig = hmac.new(
-        SECRET_KEY.encode(),
-        payload.encode(),
-        hashlib.sha256
-    ).hexdigest()
+    payload = f"{username}:{exp:010d}"
+    sig = base64.urlsafe_b64encode(_sign(payload)).rstrip(b"=").decode()
     return f"{payload}:{sig}"
 
-def _verify_token(token: str) -> bool:
+def _token_exp(token: str) -> Optional[int]:
+    """Devolve o exp se a assinatura confere (sem olhar o relógio), senão None."""
     try:
-        username, exp, sig = token.split(":", 2)
-        payload = f"{username}:{exp}"
-        expected = hmac.new(
-            SECRET_KEY.encode(),
-            payload.encode(),
-            hashlib.sha256
-        ).hexdigest()
-        if not hmac.compare_digest(expected, sig):
-            return False
-        return int(exp) >= int(time.time())
+        payload, sig = token.rsplit(":", 1)
+        exp = int(payload[-10:])
+        provided = base64.urlsafe_b64decode(sig + "=" * (-len(sig) % 4))
     except Exception:
-        return False
+        return None
+    if not hmac.compare_digest(_sign(payload), provided):
+        return None
+    return exp
+
+# Cache LRU token -> exp dos tokens com assinatura válida: o mesmo
+# navegador reenvia o mesmo cookie por até 7 dias, então no caso comum
+# a verificação vira uma consulta ao dicionário + comparação com o relógio.
+_verified_tokens = LRUCache(maxsize=4096)
+
+# só precisamos de um cookie: regex no cabeçalho em vez do parser
+# completo (http.cookies) por trás de request.cookies
+_SESSION_RE = re.compile(r"(?:^|;)\s*" + SESSION_COOKIE + r"=([^;]*)")
+
+def _session_token(request: Request) -> Optional[str]:
+    m = _SESSION_RE.search(request.headers.get("cookie", ""))
+    return (m.group(1).strip('" ') or None) if m else None
 
-def _require_auth(request: Request):
-    token = request.cookies.get(SESSION_COOKIE)
-    if not token or not _verify_token(token):
+async def _require_auth(request: Request):
+    """
+    Dependência única de sessão: exige cookie válido ou responde 401.
+    Async: nada aqui bloqueia, então não precisa ir para o threadpool.
+    """
+    token = _session_token(request)
+    exp = _verified_tokens.get(token) if token else None
+    if exp is None and token:
+        exp = _token_exp(token)
+        if exp is not None:
+            _verified_tokens.set(token, exp)
+    if exp is None or exp < int(time.time()):
         raise HTTPException(status_code=401, detail="Acesso não autorizado.")
     return True
 
+# -----------------------------------------------------------------------------
+# Limite de requisições (token bucket em memória, por processo)
+# /login: por IP, contra força bruta na senha de acesso
+# /ask:   por sessão e por IP, para ninguém drenar o orçamento da OpenAI
+#         (login bem-sucedido é livre: sessão nova não zera o limite do IP)
+LOGIN_RATE  = (10, 60)   # 10 tentativas por minuto
+ASK_RATE    = (30, 60)   # 30 perguntas por minuto, por sessão
+ASK_IP_RATE = (60, 60)   # 60 por minuto por IP (folga para escritório atrás de NAT)
+
+class _TokenBucket:
+    """
+    Balde de fichas por chave: cada chave tem até `capacity` fichas,
+    repostas continuamente a `capacity / period` fichas por segundo.
+    Guarda no máximo `max_keys` chaves (descarta as mais antigas).
+    """
+
+    def __init__(self, capacity: int, period: float, max_keys: int = 10_000):
+        self.capacity = float(capacity)
+        self.rate = capacity / period
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # chave -> (fichas, último instante)
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """
+        Consome uma ficha. Retorna 0 se liberado, senão quantos
+        segundos faltam para a próxima ficha.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def refund(self, key: str):
+        """Devolve uma ficha gasta por take() (sem passar de `capacity`)."""
+        with self._lock:
+            item = self._buckets.get(key)
+            if item is not None:
+                self._buckets[key] = (min(self.capacity, item[0] + 1), item[1])
+
+_login_bucket = _TokenBucket(*LOGIN_RATE)
+_ask_bucket   = _TokenBucket(*ASK_RATE)
+_ask_ip_bucket = _TokenBucket(*ASK_IP_RATE)
+
+# Quantos proxies confiáveis ficam na frente do app (cada um ACRESCENTA o
+# IP que viu no fim do X-Forwarded-For). 0 = sem proxy: o cabeçalho vem
+# do próprio cliente e é ignorado. No Render (render.yaml) é 1.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0") or 0)
+
+def _client_ip(request: Request) -> str:
+    # só vale a entrada acrescentada pelo proxy confiável mais externo;
+    # as anteriores podem ter sido inventadas pelo cliente
+    fwd = request.headers.get("x-forwarded-for") if TRUSTED_PROXY_HOPS else None
+    if fwd:
+        hops = [h.strip() for h in fwd.split(",")]
+        return hops[max(len(hops) - TRUSTED_PROXY_HOPS, 0)]
+    return request.client.host if request.client else "?"
+
+def _throttle(bucket: _TokenBucket, key: str):
+    wait = bucket.take(key)
+    if wait:
+        raise HTTPException(
+            status_code=429,
+            detail="Muitas requisições. Aguarde um pouco e tente novamente.",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+async def _limit_login(request: Request):
+    # gasta a ficha já aqui (antes de ler o corpo), senão várias tentativas
+    # simultâneas passam pela checagem antes de alguma ser cobrada; o
+    # /login devolve a ficha quando a senha confere, então só falha conta
+    _throttle(_login_bucket, _client_ip(request))
+
+async def _limit_ask(request: Request):
+    ip = _client_ip(request)
+    _throttle(_ask_ip_bucket, ip)
+    _throttle(_ask_bucket, _session_token(request) or ip)
+
+# -----------------------------------------------------------------------------
+# Fila de indexação: uploads só enfileiram o caminho do PDF e um único
+# worker agrupa tudo que chegar dentro da janela em UMA chamada de
+# ingest_paths (abre o Chroma e grava o índice uma vez por lote).
+INGEST_WINDOW = 0.5  # segundos
+
+# Thread própria para a indexação (criada no lifespan): um lote grande
+# (OCR + embedding) não ocupa as threads do threadpool padrão que o /ask
+# usa para busca e LLM.
+_ingest_pool: Optional[ThreadPoolExecutor] = None
+
+_ingest_queue: Optional[asyncio.Queue] = None
+
+# A cada indexação/exclusão concluída a geração do cache de respostas
+# avança (no Redis, quando há REDIS_URL: vale para todos os workers, não
+# só para o que indexou). Ela entra na chave de todos os caches do /ask,
+# porque respostas, hits e contextos antigos deixam de valer.
+async def _bump_corpus():
+    _health_cache["ts"] = 0.0
+    _semantic_cache.clear()
+    await _answer_cache.bump()
+
+# Situação da indexação por arquivo: "pending" | "done" | "error".
+# Exposta no /list_pdfs para o painel acompanhar o que está na fila;
+# _ingest_rev muda a cada alteração e entra no ETag da lista.
+_ingest_state = {}
+_ingest_rev = 0
+
+# Jobs de indexação (um por upload), consultados em /ingest_status/{job_id}:
+# job_id -> {"filename", "status", "error"}; _job_of_file liga o arquivo
+# ao job mais recente dele (os anteriores ficam "superseded").
+_ingest_jobs = LRUCache(maxsize=1000)
+_job_of_file = {}
+
+def _set_ingest_state(name: str, state: Optional[str], error: str = None):
+    global _ingest_rev
+    if state is None:
+        _ingest_state.pop(name, None)
+    else:
+        _ingest_state[name] = state
+    _ingest_rev += 1
+    job = _ingest_jobs.get(_job_of_file.get(name))
+    if job is not None:
+        job["status"] = state or "deleted"
+        job["error"] = error
+
+def _new_ingest_job(name: str) -> str:
+    # um envio mais novo do mesmo arquivo encerra o job anterior, que não
+    # seria mais atualizado (o estado do arquivo passa a ser do novo job)
+    old = _ingest_jobs.get(_job_of_file.get(name))
+    if old is not None and old["status"] == "pending":
+        old["status"] = "superseded"
+    job_id = uuid.uuid4().hex[:16]
+    _ingest_jobs.set(job_id, {"filename": name, "status": "pending", "error": None})
+    _job_of_file[name] = job_id
+    return job_id
+
+def _ingest_batch(pending: dict):
+    """Indexa um lote {caminho: hash}. Roda na thread de indexação."""
+    for path in [p for p in pending if not os.path.isfile(p)]:
+        del pending[path]  # apagado enquanto esperava na fila
+
+    # mesmo conteúdo já indexado com outro nome: copia os embeddings
+    indexed = {d: n for n, d in list(_pdf_hashes.items())}
+    novos = []
+    for path, digest in pending.items():
+        name = os.path.basename(path)
+        origem = indexed.get(digest)
+        if origem and origem != name and _rag().clone_source(origem, name):
+            log.info(f"[INDEX] {name} reaproveitou os embeddings de {origem}")
+        else:
+            novos.append(path)
+    if novos:
+        _rag().ingest_paths(novos)
+
+    # excluído durante o lote: o delete_by_source da exclusão pode ter
+    # rodado antes do add acima, então remove de novo o que foi gravado
+    for path in pending:
+        if not os.path.isfile(path):
+            _rag().delete_by_source(os.path.basename(path))
+
+async def _ingest_worker():
+    while True:
+        batch = [await _ingest_queue.get()]
+        await asyncio.sleep(INGEST_WINDOW)
+        while not _ingest_queue.empty():
+            batch.append(_ingest_queue.get_nowait())
+        pending = dict(batch)  # caminho -> hash; o envio mais recente vence
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                _ingest_pool, _ingest_batch, pending
+            )
+            log.info(f"[INDEX] {len(pending)} PDF(s) indexado(s) no Chroma.")
+        except Exception as e:
+            log.exception("Falha ao indexar lote de PDFs")
+            for path in pending:
+                # reenviar o mesmo arquivo deve tentar indexar de novo
+                _accepted_hashes.pop(os.path.basename(path), None)
+                _set_ingest_state(
+                    os.path.basename(path), "error", f"{type(e).__name__}: {e}"
+                )
+            continue
+        for path, digest in pending.items():
+            if not os.path.isfile(path):
+                continue  # excluído no meio do lote: /delete_pdf já limpou
+            _pdf_hashes[os.path.basename(path)] = digest
+            _set_ingest_state(os.path.basename(path), "done")
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                _ingest_pool, _save_hashes, dict(_pdf_hashes)
+            )
+        except OSError:
+            log.exception("Falha ao gravar hashes dos PDFs")
+        await _bump_corpus()
+
 # -----------------------------------------------------------------------------
 # /health — status rápido
+# Por padrão só confere se o RAG já abriu o Chroma (sem consulta nenhuma).
+# /health?deep=1 faz uma busca de verdade; esse resultado fica em cache
+# por HEALTH_TTL segundos e é zerado quando a base muda (_bump_corpus).
+HEALTH_TTL = 10
+_health_cache = {"ts": 0.0, "ok": False}
+
 @app.get("/health")
-def health():
-    try:
-        ok = bool(search("teste", k=1) is not None)
-    except Exception:
-        ok = False
+def health(deep: bool = False):
+    now = time.monotonic()
+    if not deep:
+        ok = _rag_mod is not None and _rag_mod.is_ready()
+    elif _health_cache["ts"] and now - _health_cache["ts"] < HEALTH_TTL:
+        ok = _health_cache["ok"]
+    else:
+        try:
+            ok = bool(_rag().search("teste", k=1) is not None)
+        except Exception:
+            ok = False
+        _health_cache["ts"], _health_cache["ok"] = now, ok
     return {
         "status": "online",
         "rag": ok,
+        "rag_loaded": _rag_mod is not None,
         "templates_dir": TEMPLATES_DIR,
         "static_dir": STATIC_DIR,
         "upload_dir": UPLOAD_DIR,
@@ -142,10 +614,10 @@ def health():
 
 # -----------------------------------------------------------------------------
 # ROTAS DEBUG (só para você auditar — não mostrar a cliente final)
-@app.get("/_debug/vars", response_class=JSONResponse)
+@app.get("/_debug/vars")
 def debug_vars(token: str):
     # proteção básica usando o token admin
-    if token != ADMIN_UPLOAD_TOKEN:
+    if not _is_admin(token):
         raise HTTPException(status_code=401, detail="Não autorizado")
     try:
         files_now = sorted(os.listdir(UPLOAD_DIR))
@@ -158,14 +630,15 @@ def debug_vars(token: str):
         "UPLOAD_DIR": UPLOAD_DIR,
         "FILES_IN_UPLOAD_DIR": files_now,
         "CHROMA_DIR": CHROMA_DIR,
+        "ANSWER_CACHE": _answer_cache.stats(),
     }
 
-@app.get("/_debug/search", response_class=JSONResponse)
+@app.get("/_debug/search")
 def debug_search(q: str, token: str):
-    if token != ADMIN_UPLOAD_TOKEN:
+    if not _is_admin(token):
         raise HTTPException(status_code=401, detail="Não autorizado")
 
-    hits = search(q, k=4)
+    hits = _rag().search(q, k=4)
     results = []
     for (doc, md) in hits:
         results.append({
@@ -181,77 +654,167 @@ def debug_search(q: str, token: str):
 
 # -----------------------------------------------------------------------------
 # PÁGINA DO USUÁRIO (login + pergunta)
-@app.get("/", response_class=HTMLResponse)
-def page_login(request: Request):
+# "/", "/admin" e "/check_token" são rotas Starlette puras (app.add_route):
+# não passam pela injeção de dependências/validação do FastAPI.
+async def page_login(request: Request):
     # Renderiza o login.html que tem:
     #  - campo senha
     #  - botão "Entrar"
     #  - campo pergunta + botão "Perguntar"
     # A lógica JS faz POST /login e POST /ask
-    return templates.TemplateResponse("login.html", {"request": request})
+    return _page_response(request, _LOGIN_PAGE)
+
+app.add_route("/", page_login, methods=["GET"])
+
+async def _read_json(request: Request) -> dict:
+    """
+    Lê o corpo JSON direto (orjson quando disponível), sem passar pela
+    validação/conversão de corpo do FastAPI.
+    """
+    if not request.headers.get("content-type", "").startswith("application/json"):
+        raise HTTPException(status_code=415, detail="Envie o corpo como application/json.")
+    body = await request.body()
+    try:
+        data = orjson.loads(body) if ORJSON_AVAILABLE else json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="JSON inválido.")
+    return data if isinstance(data, dict) else {}
 
-@app.post("/login")
-async def login(payload: dict, response: Response):
+@app.post("/login", dependencies=[Depends(_limit_login)])
+async def login(request: Request, response: Response):
     """
     Espera JSON tipo: {"password": "senha digitada"}
     Se bater com ACCESS_PASSWORD:
       - gera cookie de sessão
       - responde {"ok": true}
     """
-    pwd = (payload or {}).get("password", "").strip()
-    if pwd != ACCESS_PASSWORD:
-        # senha errada
-        return JSONResponse(
-            {"ok": False, "error": "Senha incorreta."},
-            status_code=401
-        )
+    payload = await _read_json(request)
+    pwd = str(payload.get("password") or "").strip()
+    if not hmac.compare_digest(pwd.encode(), _ACCESS_PASSWORD_B):
+        response.status_code = 401
+        return {"ok": False, "error": "Senha incorreta."}
+    _login_bucket.refund(_client_ip(request))  # acerto não conta no limite
 
-    token = _make_token("cliente")
-    resp = JSONResponse({"ok": True})
-    resp.set_cookie(
+    response.set_cookie(
         SESSION_COOKIE,
-        token,
+        _make_token("cliente"),
         max_age=SESSION_TTL,
         httponly=True,
         samesite="lax"
     )
-    return resp
+    return {"ok": True}
+
+def _normalize_question(q: str) -> str:
+    # NFKC junta formas equivalentes (ex.: "ﬁ" e "fi", acentos compostos);
+    # depois ignora maiúsculas e espaços extras
+    return " ".join(unicodedata.normalize("NFKC", q).casefold().split())
+
+# Cache de respostas: "geração:hash da pergunta normalizada" -> [resposta, hits]
+# L1 em memória (10 min); L2 no Redis (15 min) quando REDIS_URL existe
+_answer_cache = TwoTierCache(
+    "licitabot:ask:",
+    maxsize=1024,
+    ttl=600,
+    redis_url=os.getenv("REDIS_URL"),
+    redis_ttl=900,
+)
 
-@app.post("/ask")
+# Perguntas parecidas (cosseno >= 0.97 entre os embeddings) reaproveitam
+# a resposta: [resposta, hits]. Cada item vale só para a geração do cache
+# de respostas em que foi gravado e por 10 min, como o L1 dele.
+_semantic_cache = SemanticCache(maxlen=256, threshold=0.97, ttl=600)
+
+# Hits da busca vetorial: (geração do cache de respostas, hash da
+# pergunta) -> hits, por 5 min. A geração é a compartilhada entre os
+# workers, então hits de um PDF excluído por outro worker não voltam. Cobre o que o cache de respostas não guarda (resposta que falhou
+# na OpenAI e foi repetida) sem refazer embedding + consulta ao Chroma.
+_search_cache = LRUCache(maxsize=1024, ttl=300)
+
+# Contexto montado para o modelo: perguntas diferentes costumam trazer os
+# mesmos trechos. Chave = (geração do cache de respostas, (arquivo, parte)
+# de cada hit na ordem de relevância, que decide o corte por tokens). A
+# geração é compartilhada entre os workers: um PDF reenviado por outro
+# worker também invalida este cache. 10 min, como o L1 das respostas.
+_context_cache = LRUCache(maxsize=1024, ttl=600)
+
+def _context_for(rag, hits, gen: int) -> str:
+    key = (gen, tuple((md.get("source"), md.get("chunk")) for _, md in hits))
+    ctx = _context_cache.get(key)
+    if ctx is None:
+        ctx = rag.context_from_hits(hits)
+        _context_cache.set(key, ctx)
+    return ctx
+
+@app.post("/ask", dependencies=[Depends(_require_auth), Depends(_limit_ask)])
 async def ask(
-    payload: dict,
-    ok: bool = Depends(_require_auth),
+    request: Request,
     x_admin_token: Optional[str] = Header(None),
 ):
     """
     Espera JSON: {"question": "..."}
+    0. Pergunta repetida (mesma base) -> resposta do cache; pergunta
+       quase igual (embedding parecido) -> resposta do cache semântico
     1. Faz busca vetorial (search)
     2. Gera resposta com answer()
     3. Se x_admin_token == ADMIN_UPLOAD_TOKEN -> inclui citações
     """
-    q = (payload or {}).get("question", "").strip()
+    payload = await _read_json(request)
+    q = str(payload.get("question") or "").strip()
     if not q:
         return {"answer": "Por favor, escreva sua pergunta."}
 
-    hits = search(q, k=4)
-    if not hits:
-        return {"answer": "Não encontrei essa informação na base de documentos."}
+    key = hashlib.blake2b(
+        _normalize_question(q).encode(), digest_size=16
+    ).hexdigest()
+    # geração lida ANTES da busca/LLM: se a base mudar no meio, a resposta
+    # é gravada sob a geração antiga e ninguém mais a lê
+    gen = await _answer_cache.generation()
+    answer_key = f"{gen}:{key}"
+    cached = await _answer_cache.get(answer_key)
+    if cached is not None:
+        ans, hits = cached
+    else:
+        # busca e LLM são chamadas bloqueantes (e o primeiro uso ainda
+        # importa os módulos): vão para o threadpool para não travar o
+        # event loop enquanto a OpenAI responde
+        rag = await run_in_threadpool(_rag)
+        # embedding da pergunta calculado uma vez: serve ao cache
+        # semântico e à busca no Chroma
+        try:
+            emb = await run_in_threadpool(rag.embed, q)
+        except Exception:
+            emb = None  # sem modelo local: segue só com a busca por texto
+        cached = _semantic_cache.get(emb, gen)
 
-    ctx = context_from_hits(hits)
-    try:
-        ans = answer(q, ctx)
-    except Exception as e:
-        log.exception("Falha ao consultar modelo")
-        ans = f"Erro ao consultar o modelo: {e}"
+    if cached is not None:
+        ans, hits = cached
+    else:
+        hits = _search_cache.get((gen, key))
+        if hits is None:
+            hits = await run_in_threadpool(rag.search, q, 4, emb)
+            _search_cache.set((gen, key), hits)
+        if not hits:
+            return {"answer": "Não encontrei essa informação na base de documentos."}
+
+        ctx = _context_for(rag, hits, gen)
+        try:
+            core = await run_in_threadpool(_core)
+            ans = await run_in_threadpool(core.answer, q, ctx)
+            await _answer_cache.set(answer_key, [ans, hits])
+            _semantic_cache.add(emb, [ans, hits], gen)
+        except Exception as e:
+            log.exception("Falha ao consultar modelo")
+            ans = f"Erro ao consultar o modelo: {e}"
 
-    if (x_admin_token or "").strip() == ADMIN_UPLOAD_TOKEN:
+    if _is_admin(x_admin_token):
         return {
             "answer": ans,
             "citations": [
                 {
                     "source": md.get("source"),
                     "chunk": md.get("chunk"),
-                    "excerpt": doc[:280]
+                    # chunks indexados antes do campo 'excerpt' caem no corte
+                    "excerpt": md.get("excerpt") or doc[:280]
                 }
                 for (doc, md) in hits
             ]
@@ -262,7 +825,6 @@ async def ask(
 # ÁREA DO ADMINISTRADOR
 router = APIRouter()
 
-@router.get("/admin", response_class=HTMLResponse)
 async def admin_page(request: Request):
     """
     Renderiza admin.html:
@@ -271,7 +833,9 @@ async def admin_page(request: Request):
     - botão listar PDFs
     - botão excluir
     """
-    return templates.TemplateResponse("admin.html", {"request": request})
+    return _page_response(request, _ADMIN_PAGE)
+
+app.add_route("/admin", admin_page, methods=["GET"])
 
 
 @router.get("/upload", include_in_schema=False)
@@ -283,37 +847,135 @@ def alias_upload():
     return RedirectResponse(url="/admin", status_code=307)
 
 
-@router.post("/upload_pdf")
-async def upload_pdf(
-    file: UploadFile = File(...),
-    x_admin_token: Optional[str] = Header(None),
-):
+UPLOAD_CHUNK = 8 * 1024 * 1024  # 8 MB: menos syscalls por PDF grande
+
+# Tamanho máximo por PDF (e do envio inteiro no /upload_pdfs).
+MAX_UPLOAD_MB    = int(os.getenv("MAX_UPLOAD_MB", "100") or 100)
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+MAX_BATCH_MB     = int(os.getenv("MAX_BATCH_MB", "500") or 500)
+FORM_OVERHEAD    = 1024 * 1024  # cabeçalhos/fronteiras do multipart
+
+# rota -> (limite em bytes do corpo, MB anunciados na mensagem)
+_UPLOAD_LIMITS = {
+    "/upload_pdf": (MAX_UPLOAD_BYTES + FORM_OVERHEAD, MAX_UPLOAD_MB),
+    "/upload_pdfs": (MAX_BATCH_MB * 1024 * 1024 + FORM_OVERHEAD, MAX_BATCH_MB),
+}
+
+class _UploadTooLarge(Exception):
+    pass
+
+class _UploadSizeLimit:
     """
-    Fluxo:
-    - Checa token admin
-    - Garante que é .pdf
-    - Salva em UPLOAD_DIR (que deve estar em /data/uploaded_pdfs no Render)
-    - Roda ingest_paths() para indexar no Chroma
-    - Faz pequeno preview de OCR/log
+    Middleware ASGI: o Starlette lê o multipart inteiro (e grava em disco
+    temporário) antes de a rota rodar, então o limite precisa valer aqui.
+    Content-Length acima do limite -> 413 sem ler o corpo; sem ele
+    (chunked), conta os bytes recebidos e corta quando passar.
     """
-    if not x_admin_token or x_admin_token.strip() != ADMIN_UPLOAD_TOKEN:
-        raise HTTPException(status_code=401, detail="Token de administrador inválido.")
 
-    if not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=422, detail="Envie apenas arquivos .pdf")
+    def __init__(self, app):
+        self.app = app
 
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-    destino = os.path.join(UPLOAD_DIR, file.filename)
+    async def __call__(self, scope, receive, send):
+        limits = _UPLOAD_LIMITS.get(scope["path"]) if scope["type"] == "http" else None
+        if limits is None:
+            return await self.app(scope, receive, send)
 
-    # salva o PDF fisicamente (stream seguro)
+        limit, limit_mb = limits
+        detail = f"Envio maior que o permitido ({limit_mb} MB)."
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            resp = DefaultJSONResponse({"detail": detail}, status_code=413)
+            return await resp(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            if received > limit:
+                # o FastAPI repassa HTTPException levantada durante a
+                # leitura do corpo: vira 413 normal
+                raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(_UploadSizeLimit)
+
+def _save_upload(src, destino: str, size: Optional[int] = None) -> Tuple[str, bool]:
+    """
+    Copia o arquivo temporário do upload para `destino`, calculando o
+    hash BLAKE2b no caminho. Se o conteúdo for igual ao último aceito com
+    esse nome (indexado ou ainda na fila), descarta a cópia e mantém o
+    arquivo atual.
+    Com `size` (o Starlette sempre informa o tamanho da parte), recusa PDF
+    acima de MAX_UPLOAD_BYTES e reserva o espaço antes (posix_fallocate):
+    o arquivo sai contínuo no disco e falta de espaço aparece logo no início.
+    Retorna (hash, mudou?). Roda no threadpool.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    # um único buffer reaproveitado: nenhum bytes novo de 8 MB por bloco
+    buf = bytearray(UPLOAD_CHUNK)
+    view = memoryview(buf)
+    tmp = None
     try:
-        with open(destino, "wb") as buffer:
+        if size and size > MAX_UPLOAD_BYTES:
+            raise _UploadTooLarge()
+        # nome temporário único: dois envios simultâneos do mesmo PDF não
+        # escrevem no mesmo arquivo
+        fd, tmp = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".part")
+        with os.fdopen(fd, "wb") as buffer:
+            if size and hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(buffer.fileno(), 0, size)
+                except OSError as e:
+                    if e.errno == errno.ENOSPC:
+                        raise
+                    # sistema de arquivos sem suporte: segue sem reservar
             while True:
-                chunk = await file.read(1024 * 1024)
-                if not chunk:
+                n = src.readinto(buf)
+                if not n:
                     break
-                buffer.write(chunk)
+                h.update(view[:n])
+                buffer.write(view[:n])
+            buffer.truncate()  # se o tamanho informado era maior que o real
+    except Exception:
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    digest = h.hexdigest()
+    name = os.path.basename(destino)
+    if _accepted_hashes.get(name) == digest and os.path.exists(destino):
+        os.remove(tmp)
+        return digest, False
+    os.replace(tmp, destino)
+    _accepted_hashes[name] = digest
+    _invalidate_pdf_index()
+    return digest, True
+
+
+async def _store_upload(file: UploadFile) -> Tuple[dict, Optional[str]]:
+    """
+    Salva um PDF recebido em UPLOAD_DIR, sem enfileirar. Retorna o item de
+    resposta ("status": "pending" ou "unchanged") e o hash quando o
+    conteúdo mudou (None se não há o que indexar).
+    """
+    destino = os.path.join(UPLOAD_DIR, file.filename)
+
+    # salva o PDF fisicamente (stream seguro)
+    try:
+        await file.seek(0)
+        digest, changed = await run_in_threadpool(
+            _save_upload, file.file, destino, file.size
+        )
         log.info(f"[UPLOAD] PDF salvo em {destino}")
+    except _UploadTooLarge:
+        raise HTTPException(
+            status_code=413,
+            detail=f"{file.filename}: arquivo maior que {MAX_UPLOAD_MB} MB."
+        )
     except Exception as e:
         log.exception("Falha ao salvar PDF")
         raise HTTPException(
@@ -321,85 +983,188 @@ async def upload_pdf(
             detail=f"Falha ao salvar PDF: {type(e).__name__} - {e}"
         )
 
-    # tentar ler texto bruto do PDF (inclui OCR quando disponível no rag_store)
-    try:
-        preview_txt = load_pdf_text(destino)[:500]
-    except Exception as e:
-        preview_txt = f"[ERRO AO LER TEXTO] {e}"
-    log.info(f"[OCR PREVIEW] {preview_txt}")
+    item = {"ok": True, "filename": file.filename, "saved_to": destino}
+    if not changed:
+        log.info(f"[UPLOAD] {file.filename} sem alterações; indexação mantida.")
+        item["status"] = "unchanged"
+        return item, None
+    item["status"] = "pending"
+    return item, digest
 
-    # indexar no banco vetorial
-    try:
-        ingest_paths([destino])
-        indexed_ok = True
-        idx_err = ""
-        log.info(f"[INDEX] {file.filename} indexado no Chroma.")
-    except Exception as e:
-        indexed_ok = False
-        idx_err = f"{type(e).__name__}: {e}"
-        log.exception("Falha ao indexar PDF")
 
-    return {
-        "ok": True,
-        "filename": file.filename,
-        "saved_to": destino,
-        "indexed": indexed_ok,
-        "index_error": idx_err,
-        "text_preview": preview_txt,
-    }
+def _enqueue_upload(item: dict, digest: str):
+    """
+    Põe na fila de indexação um PDF já salvo por _store_upload (o worker
+    agrupa uploads próximos; a leitura do texto/OCR acontece lá, fora da
+    resposta) e anota o job_id no item.
+    """
+    item["job_id"] = _new_ingest_job(item["filename"])
+    _set_ingest_state(item["filename"], "pending")
+    _ingest_queue.put_nowait((item["saved_to"], digest))
+
+
+@router.post("/upload_pdf", dependencies=[Depends(_require_admin)])
+async def upload_pdf(file: UploadFile = File(...)):
+    """
+    Fluxo:
+    - Checa token admin
+    - Garante que é .pdf
+    - Salva em UPLOAD_DIR (que deve estar em /data/uploaded_pdfs no Render)
+    - Enfileira o PDF para indexação no Chroma (em segundo plano) e
+      responde 202; o andamento aparece no /list_pdfs
+    """
+    if not _is_pdf(file.filename or ""):
+        raise HTTPException(status_code=422, detail="Envie apenas arquivos .pdf")
+
+    res, digest = await _store_upload(file)
+    if digest is None:
+        return res
+    _enqueue_upload(res, digest)
+    return DefaultJSONResponse(res, status_code=202)
+
+
+@router.post("/upload_pdfs", dependencies=[Depends(_require_admin)])
+async def upload_pdfs(files: List[UploadFile] = File(...)):
+    """
+    Vários PDFs num só envio. Os arquivos são gravados um de cada vez e só
+    depois de todos gravados entram na fila, um atrás do outro: o worker
+    indexa todos numa única chamada de ingest_paths, mesmo que algum
+    demore mais que INGEST_WINDOW para gravar.
+    Nome/tamanho inválido recusa o envio inteiro antes de gravar qualquer
+    arquivo; falha ao gravar um deles vira item com "ok": false e os
+    demais seguem (cada um com seu job_id).
+    """
+    nomes = [f.filename or "" for f in files]
+    if not all(_is_pdf(n) for n in nomes):
+        raise HTTPException(status_code=422, detail="Envie apenas arquivos .pdf")
+    if len(set(nomes)) != len(nomes):
+        raise HTTPException(status_code=422, detail="Há arquivos com o mesmo nome.")
+    grandes = [f.filename for f in files if (f.size or 0) > MAX_UPLOAD_BYTES]
+    if grandes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Maior que {MAX_UPLOAD_MB} MB: {', '.join(grandes)}."
+        )
+
+    # um arquivo por vez: gravar em paralelo no mesmo disco não ganha
+    # nada e cada cópia segura um buffer de UPLOAD_CHUNK na memória
+    itens, novos = [], []
+    for f in files:
+        try:
+            item, digest = await _store_upload(f)
+        except HTTPException as e:
+            itens.append({"ok": False, "filename": f.filename, "error": e.detail})
+            continue
+        if digest is not None:
+            novos.append((item, digest))
+        itens.append(item)
+    for item, digest in novos:
+        _enqueue_upload(item, digest)
+    pendentes = any(i.get("status") == "pending" for i in itens)
+    return DefaultJSONResponse(
+        {"ok": all(i["ok"] for i in itens), "files": itens},
+        status_code=202 if pendentes else 200,
+    )
+
+
+@router.get("/ingest_status/{job_id}", dependencies=[Depends(_require_admin)])
+async def ingest_status(job_id: str):
+    """
+    Situação da indexação de um upload: "pending", "done", "error"
+    (com `error`), "deleted" se o arquivo foi excluído antes ou
+    "superseded" se um envio mais novo do mesmo arquivo o substituiu.
+    """
+    job = _ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+    return {"job_id": job_id, **job}
 
 
-@router.get("/list_pdfs")
-async def list_pdfs(x_admin_token: Optional[str] = Header(None)):
+@router.get("/list_pdfs", dependencies=[Depends(_require_admin)])
+def list_pdfs(request: Request):
     """
     Retorna lista dos PDFs armazenados em UPLOAD_DIR.
     Isso prova que estão persistidos em disco.
+    `status` traz a situação da indexação dos arquivos enviados nesta
+    execução do servidor ("pending", "done" ou "error").
+    ETag = mtime da pasta + revisão da indexação: o painel que recarrega
+    a lista recebe 304 sem que ela seja montada/serializada.
+    `def` comum: stat/scandir rodam no threadpool, fora do event loop.
     """
-    if not x_admin_token or x_admin_token.strip() != ADMIN_UPLOAD_TOKEN:
-        raise HTTPException(status_code=401, detail="Token de administrador inválido.")
+    mtime = os.stat(UPLOAD_DIR).st_mtime_ns
+    etag = f'"{mtime:x}-{_ingest_rev:x}"'
 
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-    itens = sorted([
-        f for f in os.listdir(UPLOAD_DIR)
-        if f.lower().endswith(".pdf")
-    ])
-    return {"files": itens}
+    def build():
+        files = _list_pdf_names()
+        status = {f: _ingest_state[f] for f in files if f in _ingest_state}
+        return {"files": files, "status": status}
 
+    return _etag_json(
+        request, etag, build,
+        {"Last-Modified": formatdate(mtime / 1e9, usegmt=True)},
+    )
 
-@router.delete("/delete_pdf")
-async def delete_pdf(
-    name: str,
-    x_admin_token: Optional[str] = Header(None)
-):
+
+@router.post("/cache_clear", dependencies=[Depends(_require_admin)])
+async def cache_clear():
+    """Invalida os caches de respostas do /ask (local, Redis e semântico)."""
+    _semantic_cache.clear()
+    _search_cache.clear()
+    _context_cache.clear()
+    await _answer_cache.bump()
+    return {"ok": True}
+
+
+# tarefas disparadas sem await (o event loop só guarda referência fraca)
+_bg_tasks = set()
+
+def _purge_done(fut: asyncio.Future, name: str):
+    if fut.cancelled():
+        return
+    if fut.exception() is not None:
+        log.error(f"Falha ao remover {name} do Chroma", exc_info=fut.exception())
+    task = asyncio.ensure_future(_bump_corpus())
+    _bg_tasks.add(task)
+    task.add_done_callback(_bg_tasks.discard)
+
+
+@router.delete("/delete_pdf", dependencies=[Depends(_require_admin)])
+async def delete_pdf(name: str):
     """
-    Exclui um PDF e opcionalmente reindexa tudo
-    (reindex simplificada: só chama ingest_paths pros restantes).
+    Exclui um PDF e remove do Chroma só os chunks dele; os demais
+    arquivos continuam indexados como estão.
     """
-    if not x_admin_token or x_admin_token.strip() != ADMIN_UPLOAD_TOKEN:
-        raise HTTPException(status_code=401, detail="Token de administrador inválido.")
-
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    if not _is_pdf(name) or os.path.basename(name) != name:
+        raise HTTPException(status_code=422, detail="Nome de PDF inválido.")
     alvo = os.path.join(UPLOAD_DIR, name)
 
-    if not os.path.exists(alvo):
+    try:
+        # remoção no threadpool (disco do Render pode ser lento); sem
+        # checagem prévia de existência: FileNotFoundError já diz tudo
+        await run_in_threadpool(os.remove, alvo)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Arquivo não encontrado.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Falha ao excluir: {e}")
 
     try:
-        os.remove(alvo)
+        _invalidate_pdf_index()
         log.info(f"[DELETE] Removido {alvo}")
+        _set_ingest_state(name, None)
+        _accepted_hashes.pop(name, None)
+        hashes = dict(_pdf_hashes) if _pdf_hashes.pop(name, None) is not None else None
 
-        # reindexa os PDFs que sobraram
-        try:
-            remanescentes = [
-                os.path.join(UPLOAD_DIR, f)
-                for f in os.listdir(UPLOAD_DIR)
-                if f.lower().endswith(".pdf")
-            ]
-            if remanescentes:
-                ingest_paths(remanescentes)
-                log.info("[REINDEX] Base reindexada após exclusão.")
-        except Exception as e:
-            log.warning(f"[REINDEX] Falhou após exclusão: {e}")
+        def purge():
+            if hashes is not None:
+                _save_hashes(hashes)
+            _rag().delete_by_source(name)
+
+        # mesma thread da indexação: se um lote com esse PDF estiver
+        # rodando, a gravação dos hashes e a remoção dos chunks só
+        # acontecem depois dele. A resposta não espera: a base muda de
+        # versão quando a remoção terminar.
+        fut = asyncio.get_running_loop().run_in_executor(_ingest_pool, purge)
+        fut.add_done_callback(lambda f: _purge_done(f, name))
 
     except Exception as e:
         raise HTTPException(
@@ -414,15 +1179,28 @@ app.include_router(router)
 
 # -----------------------------------------------------------------------------
 # Checagem rápida de token admin via header
-@app.get("/check_token", response_class=PlainTextResponse)
-async def check_token(x_admin_token: Optional[str] = Header(None)):
-    if (x_admin_token or "").strip() == ADMIN_UPLOAD_TOKEN:
+async def check_token(request: Request):
+    if _is_admin(request.headers.get("x-admin-token")):
         return PlainTextResponse("✅ Token válido", status_code=200)
     return PlainTextResponse("❌ Token inválido", status_code=401)
 
+app.add_route("/check_token", check_token, methods=["GET"])
+
 # -----------------------------------------------------------------------------
 # MAIN uvicorn (Render chama via Dockerfile/CMD)
+# uvloop + httptools vêm do uvicorn[standard] (requirements.txt).
+# Fila de indexação, caches e limites ficam em memória por processo e o
+# Chroma persistente não é feito para vários processos gravando, por isso
+# o padrão continua 1 worker; WEB_CONCURRENCY muda isso.
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 10000))
-    uvicorn.run("app.main:app", host="0.0.0.0", port=port)
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", 1)),
+        access_log=os.environ.get("ACCESS_LOG", "0") == "1",
+    )
@@ -4,7 +4,8 @@
 
 import os
 import uuid
-from typing import List, Tuple
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
 import chromadb
 from chromadb.config import Settings
@@ -119,11 +120,18 @@ def load_pdf_text(pdf_path: str) -> str:
 # 3. Banco vetorial (ChromaDB) persistente
 ###############################################################################
 
+# coleção aberta uma vez por processo e reaproveitada pelas chamadas
+_collection = None
+
 def _get_chroma(persist_dir: str = "/data/chroma"):
     """
     Garante que temos um diretório persistente para o índice vetorial no Render.
     Em desenvolvimento local sem /data, cai para ./chroma_local dentro do repo.
     """
+    global _collection
+    if _collection is not None:
+        return _collection
+
     if not os.path.isdir("/data"):
         persist_dir = os.path.join(os.path.dirname(__file__), "chroma_local")
 
@@ -134,19 +142,49 @@ def _get_chroma(persist_dir: str = "/data/chroma"):
         settings=Settings(allow_reset=False)
     )
 
-    col = client.get_or_create_collection("licitabot_docs")
-    return col
+    # mesma instância do embed(): o modelo fica carregado uma vez só
+    _collection = client.get_or_create_collection(
+        "licitabot_docs", embedding_function=_embedding_function()
+    )
+    return _collection
+
+# Função de embedding única do processo: a coleção (_get_chroma) e o
+# embed() usam a mesma, então o modelo é carregado uma vez só
+_embed_fn = None
+
+def _embedding_function():
+    global _embed_fn
+    if _embed_fn is None:
+        from chromadb.utils import embedding_functions
+        _embed_fn = embedding_functions.DefaultEmbeddingFunction()
+    return _embed_fn
+
+def is_ready() -> bool:
+    """True se o Chroma já foi aberto neste processo (não faz consulta)."""
+    return _collection is not None
+
+def warmup():
+    """
+    Abre o Chroma e faz uma busca de teste, o que também carrega o modelo
+    de embedding. Chamada uma vez no boot (main.lifespan).
+    """
+    search("warmup", k=1, embedding=embed("warmup"))
 
 ###############################################################################
 # 4. Indexação
 ###############################################################################
 
+EXCERPT_CHARS = 280
+
 def ingest_paths(paths: List[str]) -> int:
     """
     Recebe uma lista de caminhos de PDF.
     Extrai texto, faz chunk e grava cada chunk no ChromaDB com metadados:
       - 'source' (nome do arquivo)
       - 'chunk' (número do pedaço)
+      - 'excerpt' (primeiros EXCERPT_CHARS caracteres do pedaço)
+    Chunks antigos do mesmo arquivo são apagados antes (reenvio de uma
+    versão nova não deixa trechos velhos no índice).
     Retorna quantos ARQUIVOS foram processados.
     """
     col = _get_chroma()
@@ -176,10 +214,16 @@ def ingest_paths(paths: List[str]) -> int:
         for piece in _chunk_text(full_text):
             ids.append(str(uuid.uuid4()))
             docs.append(piece)
-            metas.append({"source": base_name, "chunk": chunk_id})
+            metas.append({
+                "source": base_name,
+                "chunk": chunk_id,
+                # trecho curto já pronto para as citações do /ask
+                "excerpt": piece[:EXCERPT_CHARS],
+            })
             chunk_id += 1
 
         if ids:
+            col.delete(where={"source": base_name})
             col.add(
                 ids=ids,
                 documents=docs,
@@ -188,17 +232,59 @@ def ingest_paths(paths: List[str]) -> int:
 
     return len(paths)
 
+def delete_by_source(source: str):
+    """
+    Remove do índice todos os chunks de um PDF (pelo metadado 'source'),
+    sem reprocessar os demais arquivos.
+    """
+    col = _get_chroma()
+    col.delete(where={"source": source})
+
+def clone_source(source: str, new_source: str) -> int:
+    """
+    Copia os chunks já indexados de `source` para `new_source`, reusando
+    documentos e embeddings (mesmo PDF enviado com outro nome não passa
+    pelo modelo de embedding de novo). Retorna quantos chunks copiou.
+    """
+    col = _get_chroma()
+    got = col.get(
+        where={"source": source},
+        include=["documents", "metadatas", "embeddings"],
+    )
+    docs = got.get("documents") or []
+    if not len(docs):
+        return 0
+
+    metas = [dict(md, source=new_source) for md in got["metadatas"]]
+    col.delete(where={"source": new_source})
+    col.add(
+        ids=[str(uuid.uuid4()) for _ in docs],
+        documents=docs,
+        metadatas=metas,
+        embeddings=got["embeddings"],
+    )
+    return len(docs)
+
 ###############################################################################
 # 5. Busca
 ###############################################################################
 
-def search(query: str, k: int = 4) -> List[Tuple[str, dict]]:
+def embed(text: str) -> List[float]:
+    """Embedding de um texto com o mesmo modelo da coleção."""
+    return list(_embedding_function()([text])[0])
+
+def search(query: str, k: int = 4,
+           embedding: Optional[List[float]] = None) -> List[Tuple[str, dict]]:
     """
     Faz busca semântica no índice.
+    Com `embedding` (já calculado via embed()), não gera de novo.
     Retorna lista de tuplas (trecho_do_documento, metadados).
     """
     col = _get_chroma()
-    res = col.query(query_texts=[query], n_results=k)
+    if embedding is not None:
+        res = col.query(query_embeddings=[embedding], n_results=k)
+    else:
+        res = col.query(query_texts=[query], n_results=k)
 
     hits: List[Tuple[str, dict]] = []
     if res and res.get("documents"):
@@ -206,17 +292,40 @@ def search(query: str, k: int = 4) -> List[Tuple[str, dict]]:
             hits.append((doc, md))
     return hits
 
-def context_from_hits(hits: List[Tuple[str, dict]]) -> str:
+# Teto de tokens do contexto enviado ao modelo (o prompt do core.answer
+# soma mais algumas centenas). Cada chunk tem ~650 tokens.
+CONTEXT_MAX_TOKENS = 3000
+
+@lru_cache(maxsize=4096)
+def _token_count(text: str) -> int:
+    # os mesmos trechos voltam em várias perguntas; conta uma vez só
+    return len(ENC.encode(text))
+
+def context_from_hits(hits: List[Tuple[str, dict]],
+                      max_tokens: int = CONTEXT_MAX_TOKENS) -> str:
     """
     Monta um contexto legível para mandar pro modelo responder.
     Inclui o nome do PDF e o número do pedaço.
+    Para em `max_tokens` (os trechos vêm do mais para o menos relevante;
+    o que não couber inteiro é cortado).
+    Os trechos escolhidos saem em ordem fixa (arquivo, parte), não na
+    ordem de relevância: perguntas que recuperam os mesmos trechos geram
+    o mesmo texto, e o cache de prefixo do provedor do LLM reaproveita.
     """
     if not hits:
         return "Nenhum trecho encontrado."
 
     blocos = []
+    restante = max_tokens
     for doc, md in hits:
-        blocos.append(
-            f"[{md.get('source')} - parte {md.get('chunk')}] {doc}"
-        )
-    return "\n\n".join(blocos)
+        chave = (str(md.get("source")), md.get("chunk") or 0)
+        bloco = f"[{md.get('source')} - parte {md.get('chunk')}] {doc}"
+        n = _token_count(bloco)
+        if n > restante:
+            if restante > 0:
+                blocos.append((chave, ENC.decode(ENC.encode(bloco)[:restante])))
+            break
+        blocos.append((chave, bloco))
+        restante -= n
+    blocos.sort(key=lambda b: b[0])
+    return "\n\n".join(b for _, b in blocos)